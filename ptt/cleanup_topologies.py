@@ -55,6 +55,12 @@ else:
         return d.values()
     def listitems(d):
         return d.items()
+# Interning a string.
+try:
+    intern
+except NameError:
+    # Python 3
+    intern = sys.intern
 
 
 # Required pygplates version.
@@ -95,19 +101,20 @@ def remove_features_not_referenced_by_topologies(
         Returned list is same length as ``feature_collections``.
     """
     
-    # Convert each feature collection into a list of features so we can more easily remove features
-    # and insert features at arbitrary locations within each feature collection
-    # (for example removing an unreferenced regular feature).
-    feature_collections = [list(pygplates.FeatureCollection(feature_collection))
+    # Convert each input into a feature collection (eg, could be a filename).
+    #
+    # Note: We don't need to copy the features into a list (to remove unreferenced regular features) since
+    #       the kept features are later gathered into a new feature collection in a single pass.
+    feature_collections = [pygplates.FeatureCollection(feature_collection)
         for feature_collection in feature_collections]
     
     # Set of feature IDs of all topological polygons and networks.
     # Note that we only keep topological lines if they are referenced by a topological polygon or network.
     feature_ids_of_topological_polygons_and_networks = set()
-    # Set of feature IDs referenced by all topological polygons and networks.
+    # Set of feature IDs referenced (directly or indirectly) by all topological polygons and networks.
+    # This includes features referenced by topological lines that are referenced by topological polygons and networks.
+    # Both are accumulated into the one set (rather than two separate sets that later get combined).
     feature_ids_referenced_by_topological_polygons_and_networks = set()
-    # Set of feature IDs referenced by topological lines that are referenced by topological polygons and networks.
-    feature_ids_referenced_by_topological_lines_referenced_by_topological_polygons_and_networks = set()
     
     # The features referenced by topological polygons and networks.
     topological_polygon_and_network_references = []
@@ -117,17 +124,29 @@ def remove_features_not_referenced_by_topologies(
     # All features mapped by feature ID.
     all_features = dict()
     
+    # The feature IDs of the features in each feature collection (so we only need to query them once).
+    feature_ids_per_collection = []
+    
+    # Note: All feature IDs are stored as interned strings (rather than pygplates.FeatureId) since hashing and
+    #       comparing pygplates.FeatureId calls into pygplates, whereas strings are hashed and compared
+    #       natively by Python (and interned strings with equal contents are the same object).
+    
     # Find all topological features and their references to regular features.
-    topological_reference_visitor = _TopologicalReferenceVisitor()
+    #
+    # Note: The feature collections are visited serially. Most of the time is spent in Python visit functions
+    #       (which hold the GIL), so visiting collections in separate threads would not speed things up.
     for feature_collection in feature_collections:
+        feature_ids = []
+        feature_ids_per_collection.append(feature_ids)
         for feature in feature_collection:
-            feature_id = feature.get_feature_id()
+            feature_id = intern(feature.get_feature_id().get_string())
+            feature_ids.append(feature_id)
             
             # Enable any feature to be looked up using its feature ID.
             all_features[feature_id] = feature
             
             # See if the current feature has a topological geometry and (if so) find the features it references.
-            topology_type, topological_references = topological_reference_visitor.visit_feature(feature)
+            topology_type, topological_references = _find_topological_references(feature)
             
             # For topological lines, we'll just keep track of their references for later since we don't yet know
             # which topological lines (if any) will in turn be referenced by topological polygons and  networks.
@@ -212,7 +231,7 @@ def remove_features_not_referenced_by_topologies(
             # If the referenced time period and the topological line valid time overlap.
             if reference_begin_time >= reference_end_time:
                 # Add the features referenced by the current topological line (which is referenced by a topological polygon or network).
-                feature_ids_referenced_by_topological_lines_referenced_by_topological_polygons_and_networks.update(feature_ids_referenced_in_time_period)
+                feature_ids_referenced_by_topological_polygons_and_networks.update(feature_ids_referenced_in_time_period)
                 
                 # Iterate over referenced feature IDs for the currently referenced time period.
                 for referenced_feature_id in feature_ids_referenced_in_time_period:
@@ -242,131 +261,172 @@ def remove_features_not_referenced_by_topologies(
     # or indirectly by them. For example, a topological polygon might reference a topological line which
     # in turn references regular features. In this case the topological line and the features it references
     # must all be kept.
-    feature_ids_to_keep = (feature_ids_of_topological_polygons_and_networks |
-                           feature_ids_referenced_by_topological_polygons_and_networks |
-                           feature_ids_referenced_by_topological_lines_referenced_by_topological_polygons_and_networks)
-    for feature_collection in feature_collections:
+    #
+    # Note: We add the topological polygons and networks to the (typically much larger) set of referenced features
+    # in-place (rather than creating a union of both sets) since the referenced set is no longer needed by itself.
+    # This way each feature to be removed is tested with a single set lookup.
+    feature_ids_to_keep = feature_ids_referenced_by_topological_polygons_and_networks
+    feature_ids_to_keep.update(feature_ids_of_topological_polygons_and_networks)
+    
+    # Our (potentially) modified feature collections.
+    output_feature_collections = []
+    for feature_collection, feature_ids in zip(feature_collections, feature_ids_per_collection):
         # Create an extra feature collection (containing removed features) for each feature collection.
         if removed_features_collections is not None:
             removed_features_collection = pygplates.FeatureCollection()
             removed_features_collections.append(removed_features_collection)
         
-        feature_index = 0
-        while feature_index < len(feature_collection):
-            feature = feature_collection[feature_index]
-            feature_id = feature.get_feature_id()
-            if feature_id not in feature_ids_to_keep:
-                del feature_collection[feature_index]
-                feature_index -= 1
-                
-                # Keep track of the removed feature if requested.
-                if removed_features_collections is not None:
-                    removed_features_collection.add(feature)
-            
-            feature_index += 1
+        # If all features in the current feature collection are kept (eg, a collection containing only
+        # topological polygons/networks and features they reference) then there's nothing to remove.
+        # Note that this test iterates over the feature IDs in C (rather than Python).
+        if feature_ids_to_keep.issuperset(feature_ids):
+            output_feature_collections.append(feature_collection)
+            continue
+        
+        # Gather the kept features in a single pass (rather than deleting features one at a time,
+        # which shifts all subsequent features in a list for each deletion).
+        kept_features = []
+        for feature, feature_id in zip(feature_collection, feature_ids):
+            if feature_id in feature_ids_to_keep:
+                kept_features.append(feature)
+            # Keep track of the removed feature if requested.
+            elif removed_features_collections is not None:
+                removed_features_collection.add(feature)
+        
+        output_feature_collections.append(pygplates.FeatureCollection(kept_features))
     
     # Return our (potentially) modified feature collections as a list of pygplates.FeatureCollection.
-    return [pygplates.FeatureCollection(feature_collection)
-        for feature_collection in feature_collections]
+    return output_feature_collections
 
 
-# Private helper class (has '_' prefix) to find topology-related GpmlPropertyDelegate's.
-class _TopologicalReferenceVisitor(pygplates.PropertyValueVisitor):
-    ALL_TIME = float('inf'), float('-inf')  # begin_time, end_time
-    
-    def __init__(self):
-        super(_TopologicalReferenceVisitor, self).__init__()
-    
-    def visit_feature(self, feature):
-        self.topology_type = None
-        self.references = []
-        self.current_time_period = self.ALL_TIME
+# Private helper functions (have '_' prefix) to find topology-related GpmlPropertyDelegate's.
+#
+# Note: These are module-level functions (rather than methods of a pygplates.PropertyValueVisitor) that are
+#       dispatched by property value type, and pass the current time period and list of references as arguments.
+
+_ALL_TIME = float('inf'), float('-inf')  # begin_time, end_time
+
+
+def _find_topological_references(feature):
+    # Returns the topology type (None if not a topological feature) and a list of
+    # (time_period, referenced_feature_ids) for each topological line, polygon or network found.
+    references = []
+    
+    # Visit the properties in the feature to find a topological line, polygon or network.
+    for property in feature:
+        # Get the top-level property value (containing all times) not just a specific time.
+        property_value = property.get_time_dependent_value()
         
-        # Visit all properties in the feature to find a topological line, polygon or network.
-        for property in feature:
-            # Get the top-level property value (containing all times) not just a specific time.
-            property_value = property.get_time_dependent_value()
-            # Visit the property value.
-            property_value.accept_visitor(self)
+        # Most properties are not topology-related (and only a topological line, polygon or network, or a
+        # GpmlConstantValue or GpmlPiecewiseAggregation containing one, are of interest). So rather than
+        # visiting every property value via 'accept_visitor()' we skip those not in our table of visit functions.
+        visit = _PROPERTY_VALUE_VISITORS.get(type(property_value))
+        if visit:
+            topology_type = visit(property_value, _ALL_TIME, references)
             # If we visited a topological line, polygon or network then we're finished with the current feature.
-            if self.topology_type:
-                break
-        
-        return self.topology_type, self.references
-    
-    def visit_gpml_constant_value(self, gpml_constant_value):
-        # Visit the GpmlConstantValue's nested property value.
-        gpml_constant_value.get_value().accept_visitor(self)
-    
-    def visit_gpml_piecewise_aggregation(self, gpml_piecewise_aggregation):
-        # Only need to visit if contains a topological line, polygon or network.
-        value_type = gpml_piecewise_aggregation.get_value_type()
-        if (value_type == pygplates.GpmlTopologicalLine or
-            value_type == pygplates.GpmlTopologicalPolygon or
-            value_type == pygplates.GpmlTopologicalNetwork):
-            
-            # NOTE: If there's only *one* time window then we ignore its time period.
-            #
-            # We do this for the same reason that GPlates does this (this comment from the GPlates source code)...
-            #
-            # This is because GPML files created with old versions of GPlates set the time period,
-            # of the sole time window, to match that of the 'feature's time period (in the topology
-            # build/edit tools) - newer versions set it to *all* time (distant past/future) - in fact
-            # newer versions just use a GpmlConstantValue instead of GpmlPiecewiseAggregation because
-            # the topology tools cannot yet create time-dependent topology (section) lists.
-            # With old versions if the user expanded the 'feature's time period *after* building/editing
-            # the topology then the *un-adjusted* time window time period will be incorrect and hence
-            # we need to ignore it here.
-            # Those old versions were around 4 years ago (prior to GPlates 1.3) - so we really shouldn't
-            # be seeing any old topologies.
-            # Actually I can see there are some currently in the sample data for GPlates 2.0.
-            # So as a compromise we'll ignore the reconstruction time if there's only one time window
-            # (a single time window shouldn't really have any time constraints on it anyway)
-            # and respect the reconstruction time if there's more than one time window
-            # (since multiple time windows need non-overlapping time constraints).
-            # This is especially true now that pyGPlates will soon be able to generate time-dependent
-            # topologies (where the reconstruction time will need to be respected otherwise multiple
-            # networks from different time periods will get created instead of just one of them).
-            if len(gpml_piecewise_aggregation) == 1:
-                # Assume the sole time window covers *all* time (the default).
-                gpml_piecewise_aggregation[0].get_value().accept_visitor(self)
-            else:
-                # Visit the property value in each time window.
-                for gpml_time_window in gpml_piecewise_aggregation:
-                    # Restrict the time period while we're visiting the time window.
-                    self.current_time_period = gpml_time_window.get_begin_time(), gpml_time_window.get_end_time()
-                    gpml_time_window.get_value().accept_visitor(self)
-                    self.current_time_period = self.ALL_TIME
-    
-    def visit_gpml_topological_line(self, gpml_topological_line):
-        referenced_feature_ids = set()
-        # Topological line sections are topological sections (which contain a property delegate).
-        for section in gpml_topological_line.get_sections():
-            referenced_feature_ids.add(section.get_property_delegate().get_feature_id())
-        
-        self.topology_type = pygplates.GpmlTopologicalLine
-        self.references.append((self.current_time_period, referenced_feature_ids))
-    
-    def visit_gpml_topological_polygon(self, gpml_topological_polygon):
-        referenced_feature_ids = set()
-        # Topological polygon exterior sections are topological sections (which contain a property delegate).
-        for exterior_section in gpml_topological_polygon.get_exterior_sections():
-            referenced_feature_ids.add(exterior_section.get_property_delegate().get_feature_id())
-        
-        self.topology_type = pygplates.GpmlTopologicalPolygon
-        self.references.append((self.current_time_period, referenced_feature_ids))
-    
-    def visit_gpml_topological_network(self, gpml_topological_network):
-        referenced_feature_ids = set()
-        # Topological network boundary sections are topological sections (which contain a property delegate).
-        for boundary_section in gpml_topological_network.get_boundary_sections():
-            referenced_feature_ids.add(boundary_section.get_property_delegate().get_feature_id())
-        # Topological network interiors are already property delegates.
-        for interior in gpml_topological_network.get_interiors():
-            referenced_feature_ids.add(interior.get_feature_id())
-        
-        self.topology_type = pygplates.GpmlTopologicalNetwork
-        self.references.append((self.current_time_period, referenced_feature_ids))
+            if topology_type:
+                return topology_type, references
+    
+    return None, references
+
+
+def _visit_nested_property_value(property_value, time_period, references):
+    # Only a topological line, polygon or network is of interest when nested inside a GpmlConstantValue or
+    # GpmlTimeWindow. So look up its visit function directly by type rather than using pygplates' double-dispatch
+    # (ie, 'accept_visitor()' calling back into 'visit_...()'). Any other property value type is ignored.
+    visit_topology = _TOPOLOGY_VISITORS.get(type(property_value))
+    if visit_topology:
+        return visit_topology(property_value, time_period, references)
+
+
+def _visit_gpml_constant_value(gpml_constant_value, time_period, references):
+    # Visit the GpmlConstantValue's nested property value.
+    return _visit_nested_property_value(gpml_constant_value.get_value(), time_period, references)
+
+
+def _visit_gpml_piecewise_aggregation(gpml_piecewise_aggregation, time_period, references):
+    # Only need to visit if contains a topological line, polygon or network.
+    if gpml_piecewise_aggregation.get_value_type() not in _TOPOLOGY_VISITORS:
+        return
+    
+    # NOTE: If there's only *one* time window then we ignore its time period.
+    #
+    # We do this for the same reason that GPlates does this (this comment from the GPlates source code)...
+    #
+    # This is because GPML files created with old versions of GPlates set the time period,
+    # of the sole time window, to match that of the 'feature's time period (in the topology
+    # build/edit tools) - newer versions set it to *all* time (distant past/future) - in fact
+    # newer versions just use a GpmlConstantValue instead of GpmlPiecewiseAggregation because
+    # the topology tools cannot yet create time-dependent topology (section) lists.
+    # With old versions if the user expanded the 'feature's time period *after* building/editing
+    # the topology then the *un-adjusted* time window time period will be incorrect and hence
+    # we need to ignore it here.
+    # Those old versions were around 4 years ago (prior to GPlates 1.3) - so we really shouldn't
+    # be seeing any old topologies.
+    # Actually I can see there are some currently in the sample data for GPlates 2.0.
+    # So as a compromise we'll ignore the reconstruction time if there's only one time window
+    # (a single time window shouldn't really have any time constraints on it anyway)
+    # and respect the reconstruction time if there's more than one time window
+    # (since multiple time windows need non-overlapping time constraints).
+    # This is especially true now that pyGPlates will soon be able to generate time-dependent
+    # topologies (where the reconstruction time will need to be respected otherwise multiple
+    # networks from different time periods will get created instead of just one of them).
+    if len(gpml_piecewise_aggregation) == 1:
+        # Assume the sole time window covers *all* time (the default).
+        return _visit_nested_property_value(gpml_piecewise_aggregation[0].get_value(), time_period, references)
+    
+    # Visit the property value in each time window.
+    topology_type = None
+    for gpml_time_window in gpml_piecewise_aggregation:
+        # Restrict the time period to that of the time window.
+        topology_type = _visit_nested_property_value(
+            gpml_time_window.get_value(),
+            (gpml_time_window.get_begin_time(), gpml_time_window.get_end_time()),
+            references) or topology_type
+    
+    return topology_type
+
+
+def _visit_gpml_topological_line(gpml_topological_line, time_period, references):
+    # Topological line sections are topological sections (which contain a property delegate).
+    referenced_feature_ids = set(intern(section.get_property_delegate().get_feature_id().get_string())
+        for section in gpml_topological_line.get_sections())
+    
+    references.append((time_period, referenced_feature_ids))
+    return pygplates.GpmlTopologicalLine
+
+
+def _visit_gpml_topological_polygon(gpml_topological_polygon, time_period, references):
+    # Topological polygon exterior sections are topological sections (which contain a property delegate).
+    referenced_feature_ids = set(intern(exterior_section.get_property_delegate().get_feature_id().get_string())
+        for exterior_section in gpml_topological_polygon.get_exterior_sections())
+    
+    references.append((time_period, referenced_feature_ids))
+    return pygplates.GpmlTopologicalPolygon
+
+
+def _visit_gpml_topological_network(gpml_topological_network, time_period, references):
+    # Topological network boundary sections are topological sections (which contain a property delegate).
+    referenced_feature_ids = set(intern(boundary_section.get_property_delegate().get_feature_id().get_string())
+        for boundary_section in gpml_topological_network.get_boundary_sections())
+    # Topological network interiors are already property delegates.
+    referenced_feature_ids.update(intern(interior.get_feature_id().get_string())
+        for interior in gpml_topological_network.get_interiors())
+    
+    references.append((time_period, referenced_feature_ids))
+    return pygplates.GpmlTopologicalNetwork
+
+
+# Visit functions of the topological property values (indexed by property value type).
+_TOPOLOGY_VISITORS = {
+    pygplates.GpmlTopologicalLine : _visit_gpml_topological_line,
+    pygplates.GpmlTopologicalPolygon : _visit_gpml_topological_polygon,
+    pygplates.GpmlTopologicalNetwork : _visit_gpml_topological_network}
+
+# Visit functions of the top-level property values that can contain a topology (indexed by property value type).
+_PROPERTY_VALUE_VISITORS = dict(_TOPOLOGY_VISITORS)
+_PROPERTY_VALUE_VISITORS[pygplates.GpmlConstantValue] = _visit_gpml_constant_value
+_PROPERTY_VALUE_VISITORS[pygplates.GpmlPiecewiseAggregation] = _visit_gpml_piecewise_aggregation
 
 
 if __name__ == '__main__':